@@ -2,24 +2,37 @@
 # FINAL VERSION - All fixes included
 
 import os
+import copy
 import redis
-import json
+import msgpack
+import orjson
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 import logging
+import queue
+import threading
+import time
 import mlflow
 import torch
-import tempfile
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, pipeline
+from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
+from pydantic import PrivateAttr
 from typing import Any, List, Optional
 
-# Using the correct, modern wrapper for Hugging Face integration
-from langchain_huggingface import HuggingFacePipeline
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain import hub
-from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.agents import AgentAction
+from langchain_core.callbacks import BaseCallbackHandler, CallbackManagerForLLMRun
 from langchain_core.language_models.llms import LLM
+from langchain_core.prompts import BasePromptTemplate, PromptTemplate
+from langchain_core.tools import render_text_description
+from langchain_community.llms.utils import enforce_stop_tokens
 
 from tools import all_tools
+from quantize import (
+    BASE_MODEL_NAME, ADAPTER_PATH, GPTQ_MODEL_PATH, MERGED_MODEL_PATH, BASE_GPTQ_MODEL_PATH,
+    build_merged_checkpoint, build_gptq_checkpoint, build_base_gptq_checkpoint
+)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("AIDA.Agent")
@@ -28,9 +41,24 @@ logger = logging.getLogger("AIDA.Agent")
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
 AIDA_JOB_QUEUE = "aida_job_queue"
+# Jobs are popped in batches so a backlog drains with one Redis round-trip per batch.
+JOB_BATCH_SIZE = 8
+JOB_POP_TIMEOUT_SECONDS = 5
 MLFLOW_EXPERIMENT_NAME = "AIDA_Investigations"
-BASE_MODEL_NAME = "google/gemma-2b-it"
-ADAPTER_PATH = "./training/aida-gemma-2b-sre-adapter-v1"
+# "vllm" serves the model with PagedAttention and automatic prefix caching;
+# "hf" runs plain transformers generate() with our own prefix KV cache.
+LLM_BACKEND = os.getenv("AIDA_LLM_BACKEND", "vllm")
+# Compiles the HF backend's forward pass to cut per-token Python overhead. Off by
+# default until its gain on the dynamic-length decode path has been measured.
+TORCH_COMPILE = os.getenv("AIDA_TORCH_COMPILE", "false").lower() == "true"
+MAX_NEW_TOKENS = 1024
+# LoRA adapters the worker can serve, selected per job via its "adapter_name" field.
+# Extra per-team adapters are configured as "name=path,name=path" (parsed into
+# EXTRA_ADAPTERS below). With none, the default adapter stays merged into the weights
+# and costs nothing per token; with some, the unmerged base model stays resident and
+# adapters are swapped per job.
+DEFAULT_ADAPTER_NAME = "sre_v1"
+MAX_LORA_RANK = 64
 
 # --- System Prompt for the ReAct Agent ---
 SYSTEM_PROMPT = """
@@ -64,10 +92,21 @@ You must choose one format. You cannot provide both an Action and a Final Answer
 5.  **Synthesize and Conclude:** Once you have gathered sufficient evidence, switch to FORMAT 2 and provide the final answer.
 """
 
-# --- Helper Functions (Unchanged) ---
+# --- Helper Functions ---
 def connect_to_redis():
     try:
-        client = redis.Redis(host=REDIS_HOST, port=6379, db=0, decode_responses=True)
+        # A small blocking pool with keepalive and retries: a dropped connection is
+        # re-established behind the BLMPOP call instead of surfacing as an error.
+        pool = redis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=6379,
+            db=0,
+            max_connections=4,
+            socket_keepalive=True,
+            retry=Retry(ExponentialBackoff(), 3),
+            retry_on_timeout=True
+        )
+        client = redis.Redis(connection_pool=pool)
         client.ping()
         logger.info(f"Successfully connected to Redis at '{REDIS_HOST}'")
         return client
@@ -75,6 +114,25 @@ def connect_to_redis():
         logger.error(f"FATAL: Could not connect to Redis: {e}. AIDA cannot start.")
         return None
 
+def fetch_jobs(redis_client, job_batches: queue.Queue, batch_taken: threading.Event):
+    """
+    Runs on a background thread, popping up to JOB_BATCH_SIZE jobs per BLMPOP call
+    (Redis >= 7) so the next batch is already fetched while the current one is processed.
+    A batch is only popped once the worker has taken the previous one, so at most one
+    popped batch waits outside Redis besides the batch being processed.
+    """
+    while True:
+        batch_taken.wait()
+        try:
+            result = redis_client.blmpop(JOB_POP_TIMEOUT_SECONDS, 1, AIDA_JOB_QUEUE, direction="RIGHT", count=JOB_BATCH_SIZE)
+            if result:
+                _, jobs = result
+                batch_taken.clear()
+                job_batches.put(jobs)
+        except Exception:
+            logger.error("Failed to fetch jobs from Redis. Retrying...", exc_info=True)
+            time.sleep(1)
+
 def setup_mlflow():
     mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
     logger.info(f"MLflow tracking server is set to: {MLFLOW_TRACKING_URI}")
@@ -87,45 +145,316 @@ def get_or_create_experiment(experiment_name: str) -> str:
         logger.error(f"Could not get or create MLflow experiment '{experiment_name}'.", exc_info=True)
         raise
 
-def process_incident(job_data: dict, agent_executor, experiment_id: str):
+def build_react_prompt() -> PromptTemplate:
+    """
+    Puts SYSTEM_PROMPT in front of the standard ReAct template. It becomes part of the
+    static prompt prefix instead of riding along inside {input} on every LLM call.
+    """
+    react_prompt = hub.pull("hwchase17/react")
+    return PromptTemplate.from_template(f"{SYSTEM_PROMPT}\n{react_prompt.template}")
+
+def get_static_prompt_prefix(prompt: BasePromptTemplate, tools: list) -> str:
+    """
+    Renders the part of the ReAct prompt that is identical on every LLM call:
+    everything before the alert input. The prefix is cut at the last newline so the
+    tokenization boundary with the dynamic suffix is stable.
+    """
+    marker = "<<AIDA_DYNAMIC_INPUT>>"
+    rendered = prompt.format(
+        tools=render_text_description(tools),
+        tool_names=", ".join(t.name for t in tools),
+        input=marker,
+        agent_scratchpad=""
+    )
+    prefix = rendered.split(marker)[0]
+    return prefix[:prefix.rindex("\n") + 1]
+
+
+class PrefixCachedLLM(LLM):
+    """
+    A greedy Hugging Face LLM that reuses the KV cache of the static prompt prefix.
+    Every ReAct iteration re-sends the same tool descriptions and format instructions;
+    with the prefix cached, only the alert and the growing scratchpad are prefilled.
+    """
+    model: Any
+    tokenizer: Any
+    max_new_tokens: int = MAX_NEW_TOKENS
+    adapter_name: str = DEFAULT_ADAPTER_NAME
+    _prefix_ids: Optional[torch.Tensor] = None
+    _prefix_caches: dict = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "aida_prefix_cached_hf"
+
+    def cache_prefix(self, prefix: str):
+        """Tokenizes the static prefix and caches its KV for the active adapter."""
+        self._prefix_ids = self.tokenizer(prefix, return_tensors="pt").input_ids.to(self.model.device)
+        self._prefix_caches = {}
+        self._activate_adapter()
+        self._prefix_cache_for_adapter()
+        logger.info(f"Cached KV for a {self._prefix_ids.shape[1]}-token static prompt prefix.")
+
+    def _activate_adapter(self):
+        if isinstance(self.model, PeftModel):
+            self.model.set_adapter(self.adapter_name)
+
+    @torch.no_grad()
+    def _prefix_cache_for_adapter(self):
+        """The prefix KV depends on the adapter weights, so each adapter gets its own, built on first use."""
+        if self.adapter_name not in self._prefix_caches:
+            outputs = self.model(input_ids=self._prefix_ids, use_cache=True)
+            # Stored as a copy so the cached KV never aliases buffers the model reuses.
+            self._prefix_caches[self.adapter_name] = copy.deepcopy(outputs.past_key_values)
+        return self._prefix_caches[self.adapter_name]
+
+    def _reusable_prefix_cache(self, input_ids: torch.Tensor):
+        """Returns a fresh copy of the prefix KV cache if the prompt starts with the cached prefix."""
+        if self._prefix_ids is None:
+            return None
+        prefix_len = self._prefix_ids.shape[1]
+        if input_ids.shape[1] <= prefix_len or not torch.equal(input_ids[:, :prefix_len], self._prefix_ids):
+            return None
+        # generate() appends to the cache in place, so each call works on its own copy.
+        return copy.deepcopy(self._prefix_cache_for_adapter())
+
+    @torch.no_grad()
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        self._activate_adapter()
+        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids.to(self.model.device)
+        output_ids = self.model.generate(
+            input_ids=input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            past_key_values=self._reusable_prefix_cache(input_ids),
+            max_new_tokens=self.max_new_tokens,
+            do_sample=False,
+            num_beams=1,
+            use_cache=True,
+            stop_strings=stop,
+            tokenizer=self.tokenizer
+        )
+        text = self.tokenizer.decode(output_ids[0, input_ids.shape[1]:], skip_special_tokens=True)
+        return enforce_stop_tokens(text, stop) if stop else text
+
+
+class VLLMEngineLLM(LLM):
+    """
+    Exposes an in-process vLLM engine as a LangChain LLM. With prefix caching enabled,
+    vLLM reuses the KV blocks of the shared prompt prefix across ReAct iterations.
+    """
+    engine: Any
+    max_new_tokens: int = MAX_NEW_TOKENS
+    adapter_name: str = DEFAULT_ADAPTER_NAME
+    # Empty when the default adapter is merged into the served weights.
+    lora_requests: dict = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "aida_vllm"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        from vllm import SamplingParams
+
+        sampling_params = SamplingParams(temperature=0.0, max_tokens=self.max_new_tokens, stop=stop)
+        outputs = self.engine.generate(
+            [prompt],
+            sampling_params,
+            lora_request=self.lora_requests.get(self.adapter_name),
+            use_tqdm=False
+        )
+        return outputs[0].outputs[0].text
+
+
+def serves_fp8() -> bool:
+    """
+    Ada/Hopper GPUs have FP8 tensor cores, so there vLLM serves the BF16 weights
+    quantized to FP8 (e4m3), which beats the 4-bit GPTQ kernels.
+    """
+    return LLM_BACKEND == "vllm" and torch.cuda.get_device_capability() >= (8, 9)
+
+
+def load_llm(prompt: BasePromptTemplate) -> LLM:
+    """
+    Loads Gemma on the configured inference backend. With only the default adapter the
+    merged checkpoint is served; with extra adapters the unmerged base model is served
+    and the adapter is applied per job.
+    """
+    multi_adapter = bool(EXTRA_ADAPTERS)
+    # Each backend's engine is imported only when selected, so the other one does not
+    # have to be installed (or importable against this torch build).
+    if LLM_BACKEND == "vllm":
+        from vllm import LLM as VLLMEngine
+        from vllm.lora.request import LoRARequest
+
+        engine_kwargs = {"max_model_len": 8192, "enable_prefix_caching": True}
+        lora_requests = {}
+        if multi_adapter:
+            engine_kwargs.update(enable_lora=True, max_loras=len(ADAPTERS), max_lora_rank=MAX_LORA_RANK)
+            lora_requests = {name: LoRARequest(name, i + 1, path) for i, (name, path) in enumerate(ADAPTERS.items())}
+
+        if serves_fp8():
+            model_path = BASE_MODEL_NAME if multi_adapter else MERGED_MODEL_PATH
+            logger.info(f"Loading model with vLLM in FP8: {model_path}")
+            engine = VLLMEngine(model=model_path, quantization="fp8", dtype="bfloat16", **engine_kwargs)
+        else:
+            # The quantization method is read from the checkpoint's quantize_config.json,
+            # which lets vLLM pick its Marlin GPTQ kernels on GPUs that support them.
+            model_path = BASE_GPTQ_MODEL_PATH if multi_adapter else GPTQ_MODEL_PATH
+            logger.info(f"Loading GPTQ model with vLLM: {model_path}")
+            engine = VLLMEngine(model=model_path, dtype="float16", **engine_kwargs)
+        return VLLMEngineLLM(engine=engine, max_new_tokens=MAX_NEW_TOKENS, lora_requests=lora_requests)
+
+    if multi_adapter:
+        # Loaded through transformers so PEFT can attach LoRA layers to the GPTQ base.
+        logger.info(f"Loading GPTQ base model with adapters {list(ADAPTERS)}: {BASE_GPTQ_MODEL_PATH}")
+        model = AutoModelForCausalLM.from_pretrained(BASE_GPTQ_MODEL_PATH, device_map={"":0})
+        model = PeftModel.from_pretrained(model, ADAPTER_PATH, adapter_name=DEFAULT_ADAPTER_NAME)
+        for name, path in EXTRA_ADAPTERS.items():
+            model.load_adapter(path, adapter_name=name)
+        tokenizer = AutoTokenizer.from_pretrained(BASE_GPTQ_MODEL_PATH)
+    else:
+        from auto_gptq import AutoGPTQForCausalLM
+
+        # The checkpoint already has the SRE adapter merged in. AutoGPTQ dispatches the
+        # 4-bit matmuls to its fused ExLlama kernels, which are much faster at batch-size-1
+        # decode than bitsandbytes' dequantize-then-matmul NF4 path.
+        logger.info(f"Loading GPTQ model: {GPTQ_MODEL_PATH}")
+        model = AutoGPTQForCausalLM.from_quantized(
+            GPTQ_MODEL_PATH,
+            device="cuda:0",
+            use_safetensors=True,
+            inject_fused_attention=True
+        )
+        tokenizer = AutoTokenizer.from_pretrained(GPTQ_MODEL_PATH)
+    # Gemma ships sampling defaults in its generation config. Clearing them keeps
+    # generate() from building no-op logits warpers that run on every greedy step.
+    model.generation_config.temperature = None
+    model.generation_config.top_p = None
+    model.generation_config.top_k = None
+    llm = PrefixCachedLLM(model=model, tokenizer=tokenizer, max_new_tokens=MAX_NEW_TOKENS)
+    # The prefix KV is built eagerly, before the forward pass is compiled.
+    llm.cache_prefix(get_static_prompt_prefix(prompt, all_tools))
+    if TORCH_COMPILE:
+        # The GPTQ kernels are opaque to the compiler, so graph breaks are allowed around
+        # them. The default mode is used: "reduce-overhead" CUDA graphs would re-record for
+        # every KV length of the growing DynamicCache.
+        model.model.forward = torch.compile(model.model.forward, fullgraph=False)
+    return llm
+
+
+def parse_extra_adapters(spec: str) -> dict:
+    """Parses "name=path,name=path" into a dict, logging and skipping malformed entries."""
+    adapters = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, path = (part.strip() for part in entry.partition("="))
+        if not name or not path:
+            logger.error(f"Ignoring malformed AIDA_EXTRA_ADAPTERS entry '{entry}': expected 'name=path'.")
+            continue
+        if name == DEFAULT_ADAPTER_NAME:
+            logger.error(f"Ignoring AIDA_EXTRA_ADAPTERS entry '{entry}': '{name}' is the default adapter.")
+            continue
+        adapters[name] = path
+    return adapters
+
+
+EXTRA_ADAPTERS = parse_extra_adapters(os.getenv("AIDA_EXTRA_ADAPTERS", ""))
+ADAPTERS = {DEFAULT_ADAPTER_NAME: ADAPTER_PATH, **EXTRA_ADAPTERS}
+
+
+def resolve_adapter(requested: Optional[str]) -> str:
+    """Returns the adapter a job asked for, falling back to the default for unknown names."""
+    if not requested:
+        return DEFAULT_ADAPTER_NAME
+    if requested not in ADAPTERS:
+        logger.warning(f"Unknown adapter '{requested}' requested. Falling back to '{DEFAULT_ADAPTER_NAME}'.")
+        return DEFAULT_ADAPTER_NAME
+    return requested
+
+
+class TrajectoryLogger(BaseCallbackHandler):
+    """
+    Streams each agent step to MLflow as `trajectory/step_{i}.json` as soon as its tool
+    returns. Peak memory stays flat on long investigations, and the steps taken so far
+    are persisted even if the investigation crashes.
+    """
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+        self.client = mlflow.tracking.MlflowClient()
+        self.step_count = 0
+        self._pending_action: Optional[AgentAction] = None
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any):
+        self._pending_action = action
+
+    def on_tool_end(self, output: Any, **kwargs: Any):
+        if self._pending_action is None:
+            return
+        action, self._pending_action = self._pending_action, None
+        self.step_count += 1
+        step = {
+            "tool": action.tool,
+            "tool_input": action.tool_input,
+            "log": action.log,
+            "observation": str(getattr(output, "content", output))
+        }
+        self.client.log_dict(self.run_id, step, f"trajectory/step_{self.step_count}.json")
+
+    def on_tool_error(self, error: BaseException, **kwargs: Any):
+        self._pending_action = None
+
+
+def process_incident(job_data: dict, agent_executor, llm: LLM, experiment_id: str):
     incident_id = job_data.get("incident_id", "unknown-incident")
     alert_data = job_data.get("raw_alert", {})
+    # The webhook forwards the alert as the raw JSON bytes it received; jobs queued
+    # by older webhook versions carry it already decoded.
+    if isinstance(alert_data, bytes):
+        alert_data = orjson.loads(alert_data)
+    # The worker handles one job at a time, so the LLM can be pointed at this job's adapter.
+    llm.adapter_name = resolve_adapter(job_data.get("adapter_name"))
     logger.info(f"[{incident_id}] Starting investigation...")
 
-    input_prompt = f"""
-{SYSTEM_PROMPT}
-
-An alert has fired. Here is the alert data in JSON format:
-{json.dumps(alert_data, indent=2)}
-
-Please investigate and determine the root cause, following all rules. Begin!
-"""
+    input_prompt = f"An alert has fired. Determine its root cause. Alert data (JSON):\n{orjson.dumps(alert_data).decode()}"
 
     with mlflow.start_run(experiment_id=experiment_id, run_name=f"Incident-{incident_id}") as run:
         run_id = run.info.run_id
         mlflow.set_tag("incident_id", incident_id)
         alert_name = alert_data.get('alerts', [{}])[0].get('labels', {}).get('alertname', 'Unknown Alert')
         mlflow.set_tag("alert_name", alert_name)
+        mlflow.set_tag("adapter_name", llm.adapter_name)
         
-        with tempfile.TemporaryDirectory() as tmpdir:
-            alert_payload_path = os.path.join(tmpdir, "alert_payload.json")
-            with open(alert_payload_path, "w") as f:
-                json.dump(alert_data, f, indent=4)
-            mlflow.log_artifact(alert_payload_path)
-            
-            try:
-                response = agent_executor.invoke({"input": input_prompt})
-                logger.info(f"[{incident_id}] Agent finished investigation.")
-                final_report = {
-                    "final_conclusion": response.get('output', 'No output from agent.'),
-                    "full_trajectory": [str(x) for x in response.get('intermediate_steps', [])]
-                }
-                mlflow.log_dict(final_report, "final_report.json")
-                mlflow.set_tag("investigation_status", "complete_success")
-            except Exception as e:
-                logger.error(f"[{incident_id}] Agent investigation failed!", exc_info=True)
-                mlflow.log_param("error_message", str(e))
-                mlflow.set_tag("investigation_status", "complete_failure")
+        mlflow.log_dict(alert_data, "alert_payload.json")
+
+        try:
+            trajectory_logger = TrajectoryLogger(run_id)
+            response = agent_executor.invoke({"input": input_prompt}, config={"callbacks": [trajectory_logger]})
+            logger.info(f"[{incident_id}] Agent finished investigation.")
+            final_report = {
+                "final_conclusion": response.get('output', 'No output from agent.'),
+                "trajectory_steps": trajectory_logger.step_count
+            }
+            mlflow.log_dict(final_report, "final_report.json")
+            mlflow.set_tag("investigation_status", "complete_success")
+        except Exception as e:
+            logger.error(f"[{incident_id}] Agent investigation failed!", exc_info=True)
+            mlflow.log_param("error_message", str(e))
+            mlflow.set_tag("investigation_status", "complete_failure")
         logger.info(f"[{incident_id}] Investigation logged to MLflow run {run_id}.")
 
 
@@ -138,49 +467,55 @@ def main():
 
     logger.info("--- Initializing Self-Hosted AIDA Agent (Gemma-2B) ---")
     
-    quant_config = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_quant_type="nf4", bnb_4bit_compute_dtype=torch.bfloat16)
-    
-    logger.info(f"Loading base model: {BASE_MODEL_NAME}")
-    model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_NAME, quantization_config=quant_config, device_map={"":0})
-    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
-    
-    if not os.path.isdir(ADAPTER_PATH):
+    # First start on this volume: build the checkpoint load_llm will serve once, later
+    # starts reuse it. FP8 serving quantizes on the fly, so it only needs the merged
+    # BF16 model, and nothing at all when the base model is served from the Hub.
+    # With extra adapters the SRE adapter is applied at load time rather than merged.
+    if EXTRA_ADAPTERS and not os.path.isdir(ADAPTER_PATH):
         logger.critical(f"FATAL: Adapter path not found at '{ADAPTER_PATH}'.")
         return
-        
-    logger.info(f"Loading and merging LoRA adapter from: {ADAPTER_PATH}")
-    model = PeftModel.from_pretrained(model, ADAPTER_PATH)
-    model = model.merge_and_unload()
-    
-    pipe = pipeline(
-        "text-generation",
-        model=model,
-        tokenizer=tokenizer,
-        max_new_tokens=1024,
-        temperature=0.0,
-        do_sample=False # The critical fix
-    )
+    try:
+        if serves_fp8():
+            if not EXTRA_ADAPTERS:
+                build_merged_checkpoint()
+        elif EXTRA_ADAPTERS and not os.path.isdir(BASE_GPTQ_MODEL_PATH):
+            logger.info(f"GPTQ base checkpoint not found at '{BASE_GPTQ_MODEL_PATH}'. Building it now...")
+            build_base_gptq_checkpoint()
+        elif not EXTRA_ADAPTERS and not os.path.isdir(GPTQ_MODEL_PATH):
+            logger.info(f"GPTQ checkpoint not found at '{GPTQ_MODEL_PATH}'. Building it now...")
+            build_gptq_checkpoint()
+    except (FileNotFoundError, ValueError) as e:
+        logger.critical(f"FATAL: {e}")
+        return
 
-    llm = HuggingFacePipeline(pipeline=pipe)
-    
-    prompt = hub.pull("hwchase17/react")
+    prompt = build_react_prompt()
+    llm = load_llm(prompt)
     agent = create_react_agent(llm, all_tools, prompt)
     agent_executor = AgentExecutor(
         agent=agent,
         tools=all_tools,
         verbose=True,
-        return_intermediate_steps=True,
         handle_parsing_errors=True # Crucial for robustness
     )
 
     logger.info("AIDA Agent (Self-Hosted with Gemma-2B) is fully initialized. Listening on queue...")
+    # Hold at most one prefetched batch so popped-but-unprocessed jobs, which a restart
+    # would lose, stay bounded.
+    job_batches = queue.Queue(maxsize=1)
+    batch_taken = threading.Event()
+    batch_taken.set()
+    threading.Thread(
+        target=fetch_jobs, args=(redis_client, job_batches, batch_taken), daemon=True, name="job-fetcher"
+    ).start()
     while True:
-        try:
-            _, job_json = redis_client.brpop(AIDA_JOB_QUEUE)
-            job_data = json.loads(job_json)
-            process_incident(job_data, agent_executor, experiment_id)
-        except Exception:
-            logger.error("A critical error occurred in the main loop.", exc_info=True)
+        batch = job_batches.get()
+        batch_taken.set()
+        for job_blob in batch:
+            try:
+                job_data = msgpack.unpackb(job_blob, raw=False)
+                process_incident(job_data, agent_executor, llm, experiment_id)
+            except Exception:
+                logger.error("A critical error occurred in the main loop.", exc_info=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
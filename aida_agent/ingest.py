@@ -2,10 +2,15 @@
 # This script reads documents from the runbooks directory, splits them,
 # creates vector embeddings, and stores them in a persistent ChromaDB.
 import os
+import glob
+import hashlib
 import logging
-from langchain_community.document_loaders import DirectoryLoader
+import chardet
+import chromadb
+from concurrent.futures import ProcessPoolExecutor
+from langchain_core.documents import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.embeddings import FastEmbedEmbeddings
 from langchain_community.vectorstores import Chroma
 
 # --- Setup ---
@@ -19,10 +24,36 @@ RUNBOOKS_PATH = "runbooks"
 # This is mapped to a Docker volume in docker-compose.yml.
 CHROMA_PERSIST_DIR = "/data/chroma_db"
 # This is a highly-rated, lightweight, and fast sentence-transformer model.
-# It runs entirely on the CPU.
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# It runs entirely on the CPU, as an ONNX Runtime graph via FastEmbed.
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Chunks are encoded in large batches to keep the CPU matmul kernels busy.
+EMBEDDING_BATCH_SIZE = 256
+# Kept on the Hugging Face cache volume, the same place the model lived before.
+EMBEDDING_CACHE_DIR = os.path.expanduser("~/.cache/huggingface/fastembed")
 # The name for our collection inside the vector store.
 CHROMA_COLLECTION_NAME = "aida_runbooks"
+# HNSW index settings. A denser graph (M) and a larger construction_ef give better
+# recall, which lets search run with a small search_ef. Chroma only applies these
+# when the collection is first created, so a collection built with different
+# settings (or a different embedding model) is rebuilt from scratch.
+CHROMA_COLLECTION_METADATA = {
+    "embedding_model": EMBEDDING_MODEL_NAME,
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64
+}
+
+
+def _load_one_md(path: str) -> Document:
+    """Reads a single markdown runbook, detecting its encoding if it is not UTF-8."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode(chardet.detect(raw)["encoding"] or "utf-8", errors="replace")
+    return Document(page_content=text.strip(), metadata={"source": path})
 
 
 def main():
@@ -36,14 +67,10 @@ def main():
     logger.info("Starting runbook ingestion process...")
 
     # 1. Load Documents from the runbooks directory
-    loader = DirectoryLoader(
-        RUNBOOKS_PATH,
-        glob="**/*.md", # Look for all markdown files in all subdirectories
-        show_progress=True,
-        use_multithreading=True,
-        loader_kwargs={"autodetect_encoding": True}
-    )
-    documents = loader.load()
+    # Each file is read and decoded in a worker process, so parsing is not bound by the GIL.
+    paths = glob.glob(os.path.join(RUNBOOKS_PATH, "**", "*.md"), recursive=True) # All markdown files in all subdirectories
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        documents = list(executor.map(_load_one_md, paths))
     if not documents:
         logger.warning("No markdown documents found. Exiting.")
         return
@@ -58,13 +85,23 @@ def main():
     chunks = text_splitter.split_documents(documents)
     logger.info(f"Split documents into {len(chunks)} chunks.")
 
+    # Identical chunks (e.g. shared boilerplate across runbooks) are embedded once.
+    # The content hash doubles as the vector ID, so re-running ingestion upserts
+    # unchanged chunks instead of duplicating them.
+    unique_chunks = {}
+    for chunk in chunks:
+        chunk_id = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        unique_chunks.setdefault(chunk_id, chunk)
+    logger.info(f"{len(unique_chunks)} unique chunks after deduplication.")
+
     # 3. Initialize the Embedding Model
-    # This model will be downloaded from Hugging Face automatically the first time.
+    # The ONNX model is downloaded automatically the first time.
     # The ~/.cache/huggingface volume in docker-compose ensures it's not re-downloaded every time.
     logger.info(f"Initializing embedding model: {EMBEDDING_MODEL_NAME}")
-    embeddings = HuggingFaceEmbeddings(
+    embeddings = FastEmbedEmbeddings(
         model_name=EMBEDDING_MODEL_NAME,
-        model_kwargs={'device': 'cpu'} # Explicitly use CPU
+        cache_dir=EMBEDDING_CACHE_DIR,
+        batch_size=EMBEDDING_BATCH_SIZE
     )
     logger.info("Embedding model loaded.")
 
@@ -72,11 +109,21 @@ def main():
     # This will create the ChromaDB collection on disk. If it already exists,
     # running this again will add new/updated documents.
     logger.info(f"Creating and persisting vector store at: {CHROMA_PERSIST_DIR}")
+    client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+    try:
+        existing_metadata = client.get_collection(CHROMA_COLLECTION_NAME).metadata
+    except Exception:
+        existing_metadata = None # The collection does not exist yet
+    if existing_metadata is not None and existing_metadata != CHROMA_COLLECTION_METADATA:
+        logger.info("Existing collection was built with different settings. Rebuilding it.")
+        client.delete_collection(CHROMA_COLLECTION_NAME)
     vector_store = Chroma.from_documents(
-        documents=chunks,
+        documents=list(unique_chunks.values()),
+        ids=list(unique_chunks.keys()),
         embedding=embeddings,
         collection_name=CHROMA_COLLECTION_NAME,
-        persist_directory=CHROMA_PERSIST_DIR
+        collection_metadata=CHROMA_COLLECTION_METADATA,
+        client=client
     )
 
     logger.info("Ingestion complete. Vector store has been persisted.")
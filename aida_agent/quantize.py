@@ -0,0 +1,172 @@
+# AIDA/aida_agent/quantize.py
+# This script merges the fine-tuned SRE LoRA adapter into the Gemma-2B base model
+# and converts the result into a 4-bit GPTQ checkpoint. The agent loads this
+# checkpoint at startup (building it on the first start if it is missing), so the
+# conversion only has to run once per adapter version.
+import os
+import json
+import logging
+import random
+import shutil
+import torch
+from datasets import load_dataset
+from transformers import AutoTokenizer, AutoModelForCausalLM
+from peft import PeftModel
+
+# --- Setup ---
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("AIDA.Quantize")
+
+# --- Constants ---
+BASE_MODEL_NAME = "google/gemma-2b-it"
+ADAPTER_PATH = "./training/aida-gemma-2b-sre-adapter-v1"
+# Both checkpoints live on the Hugging Face cache volume so they survive container rebuilds.
+MERGED_MODEL_PATH = os.getenv(
+    "AIDA_MERGED_MODEL_PATH",
+    os.path.expanduser("~/.cache/huggingface/aida/gemma-2b-sre-v1-merged")
+)
+GPTQ_MODEL_PATH = os.getenv(
+    "AIDA_GPTQ_MODEL_PATH",
+    os.path.expanduser("~/.cache/huggingface/aida/gemma-2b-sre-v1-gptq")
+)
+# The base model quantized without any adapter merged in, for serving several
+# LoRA adapters on top of one resident model.
+BASE_GPTQ_MODEL_PATH = os.getenv(
+    "AIDA_BASE_GPTQ_MODEL_PATH",
+    os.path.expanduser("~/.cache/huggingface/aida/gemma-2b-gptq")
+)
+# GPTQ is calibrated on random windows of a general-text corpus, the standard recipe,
+# so every layer sees a broad activation distribution. For the SRE model, exported
+# validated investigations (the closest thing we have to real agent traffic) make up
+# to half of the samples.
+CALIBRATION_CORPUS = ("wikitext", "wikitext-2-raw-v1")
+CALIBRATION_DATASET = "./training/aida_training_dataset.jsonl"
+CALIBRATION_NUM_SAMPLES = 128
+CALIBRATION_MIN_SAMPLES = 32
+CALIBRATION_MAX_LENGTH = 2048
+CALIBRATION_SEED = 0
+
+
+def load_calibration_examples(tokenizer, include_sre_samples: bool) -> list:
+    """
+    Tokenizes CALIBRATION_NUM_SAMPLES calibration examples for GPTQ: exported training
+    samples first (if requested and available), topped up with random windows from
+    the general-text corpus. Raises ValueError if fewer than CALIBRATION_MIN_SAMPLES
+    examples can be built.
+    """
+    examples = []
+    if include_sre_samples and os.path.isfile(CALIBRATION_DATASET):
+        with open(CALIBRATION_DATASET, "r") as f:
+            for line in f:
+                if len(examples) >= CALIBRATION_NUM_SAMPLES // 2:
+                    break
+                if not line.strip():
+                    continue
+                encoded = tokenizer(
+                    json.loads(line)["text"],
+                    truncation=True,
+                    max_length=CALIBRATION_MAX_LENGTH,
+                    return_tensors="pt"
+                )
+                examples.append({"input_ids": encoded["input_ids"], "attention_mask": encoded["attention_mask"]})
+        logger.info(f"Using {len(examples)} exported training samples for calibration.")
+
+    corpus = load_dataset(*CALIBRATION_CORPUS, split="train")
+    corpus_ids = tokenizer("\n\n".join(corpus["text"]), return_tensors="pt")["input_ids"]
+    if corpus_ids.shape[1] > CALIBRATION_MAX_LENGTH:
+        rng = random.Random(CALIBRATION_SEED)
+        while len(examples) < CALIBRATION_NUM_SAMPLES:
+            start = rng.randint(0, corpus_ids.shape[1] - CALIBRATION_MAX_LENGTH)
+            window = corpus_ids[:, start:start + CALIBRATION_MAX_LENGTH]
+            examples.append({"input_ids": window, "attention_mask": torch.ones_like(window)})
+
+    if len(examples) < CALIBRATION_MIN_SAMPLES:
+        raise ValueError(
+            f"Only {len(examples)} GPTQ calibration samples could be built; "
+            f"at least {CALIBRATION_MIN_SAMPLES} are required."
+        )
+    return examples
+
+
+def _save_atomically(save_fn, path: str):
+    """
+    Writes a checkpoint to a staging directory and renames it into place, so a crash
+    mid-save never leaves behind a partial checkpoint that later starts would trust.
+    """
+    staging_path = f"{path}.partial"
+    shutil.rmtree(staging_path, ignore_errors=True)
+    save_fn(staging_path)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(staging_path, path)
+
+
+def build_merged_checkpoint():
+    """
+    Merges the LoRA adapter into the full-precision base model and persists the result.
+    Merging before quantization folds the adapter into the linear layers, so no LoRA
+    matmuls remain in the decode hot path. Skipped if the merged checkpoint exists.
+    """
+    if os.path.isdir(MERGED_MODEL_PATH):
+        logger.info(f"Merged checkpoint already exists at {MERGED_MODEL_PATH}. Skipping merge.")
+        return
+    if not os.path.isdir(ADAPTER_PATH):
+        raise FileNotFoundError(f"Adapter path not found at '{ADAPTER_PATH}'.")
+
+    logger.info(f"Loading base model {BASE_MODEL_NAME} and merging adapter from {ADAPTER_PATH}")
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL_NAME)
+    model = AutoModelForCausalLM.from_pretrained(BASE_MODEL_NAME, torch_dtype=torch.bfloat16, device_map={"":0})
+    model = PeftModel.from_pretrained(model, ADAPTER_PATH).merge_and_unload()
+
+    def save(path):
+        model.save_pretrained(path, safe_serialization=True)
+        tokenizer.save_pretrained(path)
+
+    _save_atomically(save, MERGED_MODEL_PATH)
+    logger.info(f"Merged checkpoint saved to: {MERGED_MODEL_PATH}")
+
+    del model
+    torch.cuda.empty_cache()
+
+
+def _quantize_to_gptq(source: str, target_path: str, include_sre_samples: bool):
+    """Quantizes a full-precision checkpoint (local path or Hub name) to 4-bit GPTQ."""
+    # Imported here so the agent can import this module's paths and the merge step
+    # on the vLLM backend without auto-gptq installed.
+    from auto_gptq import AutoGPTQForCausalLM, BaseQuantizeConfig
+
+    logger.info(f"Quantizing {source} to 4-bit GPTQ...")
+    tokenizer = AutoTokenizer.from_pretrained(source)
+    # Saved as model.safetensors (auto-gptq's default is gptq_model-4bit-128g), the name
+    # transformers looks for, so the multi-adapter HF path can load the base checkpoint
+    # with from_pretrained. auto-gptq and vLLM read the name from quantize_config.json.
+    quantize_config = BaseQuantizeConfig(bits=4, group_size=128, desc_act=False, model_file_base_name="model")
+    model = AutoGPTQForCausalLM.from_pretrained(source, quantize_config=quantize_config, torch_dtype=torch.float16)
+    model.quantize(load_calibration_examples(tokenizer, include_sre_samples))
+
+    def save(path):
+        model.save_quantized(path, use_safetensors=True)
+        tokenizer.save_pretrained(path)
+
+    _save_atomically(save, target_path)
+    logger.info(f"GPTQ checkpoint saved to: {target_path}")
+
+    del model
+    torch.cuda.empty_cache()
+
+
+def build_gptq_checkpoint():
+    """Quantizes the merged model to a 4-bit GPTQ checkpoint, merging it first if needed."""
+    build_merged_checkpoint()
+    _quantize_to_gptq(MERGED_MODEL_PATH, GPTQ_MODEL_PATH, include_sre_samples=True)
+
+
+def build_base_gptq_checkpoint():
+    """
+    Quantizes the base model, without any adapter, to a 4-bit GPTQ checkpoint. The SRE
+    transcripts were produced with the adapter applied, so only general text is used.
+    """
+    _quantize_to_gptq(BASE_MODEL_NAME, BASE_GPTQ_MODEL_PATH, include_sre_samples=False)
+
+
+if __name__ == "__main__":
+    build_gptq_checkpoint()
@@ -1,7 +1,10 @@
 # AIDA/aida_agent/tools.py
+import os
+import functools
 import logging
+import chromadb
 from langchain.tools import tool
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.embeddings import FastEmbedEmbeddings
 from langchain_community.vectorstores import Chroma
 
 # --- Setup ---
@@ -9,9 +12,38 @@ logger = logging.getLogger("AIDA.Tools")
 
 # --- Constants for RAG Tool ---
 CHROMA_PERSIST_DIR = "/data/chroma_db"
-EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_CACHE_DIR = os.path.expanduser("~/.cache/huggingface/fastembed")
 CHROMA_COLLECTION_NAME = "aida_runbooks"
 
+# --- Retriever ---
+
+@functools.lru_cache(maxsize=1)
+def _get_retriever():
+    """
+    Builds the runbook retriever once per process. Loading the sentence-transformer
+    and opening the Chroma collection is far more expensive than a single search,
+    and the agent may call `search_runbooks` several times per incident.
+    """
+    # Initialize the same embedding model used for ingestion
+    embeddings = FastEmbedEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        cache_dir=EMBEDDING_CACHE_DIR
+    )
+
+    # Open the persisted vector store. get_collection fails fast (and is retried on the
+    # next call) if ingestion has not run yet, instead of creating an empty collection.
+    client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+    client.get_collection(CHROMA_COLLECTION_NAME)
+    vector_store = Chroma(
+        client=client,
+        collection_name=CHROMA_COLLECTION_NAME,
+        embedding_function=embeddings
+    )
+
+    # Create a retriever to find the most relevant documents
+    return vector_store.as_retriever(search_kwargs={"k": 3}) # Get top 3 results
+
 # --- Tool Definitions ---
 
 @tool
@@ -23,24 +55,8 @@ def search_runbooks(query: str) -> str:
     description of the problem you are trying to solve.
     """
     try:
-        # Initialize the same embedding model used for ingestion
-        embeddings = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL_NAME,
-            model_kwargs={'device': 'cpu'}
-        )
-
-        # Load the persisted vector store
-        vector_store = Chroma(
-            persist_directory=CHROMA_PERSIST_DIR,
-            embedding_function=embeddings,
-            collection_name=CHROMA_COLLECTION_NAME
-        )
-
-        # Create a retriever to find the most relevant documents
-        retriever = vector_store.as_retriever(search_kwargs={"k": 3}) # Get top 3 results
-
         logger.info(f"Searching runbooks with query: '{query}'")
-        results = retriever.get_relevant_documents(query)
+        results = _get_retriever().invoke(query)
 
         if not results:
             return "No relevant documents found in the runbooks for this query."
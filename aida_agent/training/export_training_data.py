@@ -1,9 +1,12 @@
 # AIDA/aida_agent/training/export_training_data.py
 import os
-import json
+import ast
 import mlflow
+import orjson
 import logging
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Basic Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -13,46 +16,99 @@ logger = logging.getLogger("AIDA.DataExporter")
 MLFLOW_TRACKING_URI = "http://mlflow:5000"
 INVESTIGATION_EXPERIMENT_NAME = "AIDA_Investigations"
 OUTPUT_FILE = "aida_training_dataset.jsonl" # Using a clear, specific name
+# Artifact downloads are network-bound, so several runs are fetched concurrently.
+DOWNLOAD_WORKERS = 16
+# Only human-validated investigations become training data.
+VALIDATED_FEEDBACK_STATUSES = ["Approved", "Corrected"]
 
 # --- MLflow Connection ---
 mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
 client = mlflow.tracking.MlflowClient()
 
-# --- Robust Parsing Logic ---
-# This ensures our data is formatted perfectly before exporting
-class SimpleToolAction:
-    def __init__(self, tool, tool_input):
-        self.tool = tool
-        self.tool_input = tool_input
+# --- Trajectory Loading ---
+# The agent streams every step to `trajectory/step_{i}.json` as structured JSON,
+# so the exporter only has to read the files back in order. Runs logged before that
+# are parsed from the step reprs in their final report, like the feedback UI does.
+def load_trajectory(local_path: str, report: dict) -> list:
+    trajectory_dir = os.path.join(local_path, "trajectory")
+    if not os.path.isdir(trajectory_dir):
+        # Older runs embedded the steps in the final report as reprs of
+        # (AgentAction, observation) tuples.
+        legacy_steps = [parse_legacy_step(s) for s in report.get("full_trajectory", []) if s]
+        return [step for step in legacy_steps if step is not None]
+    step_files = sorted(os.listdir(trajectory_dir), key=lambda name: int(name[len("step_"):-len(".json")]))
+    trajectory = []
+    for step_file in step_files:
+        with open(os.path.join(trajectory_dir, step_file), "r") as f:
+            trajectory.append(orjson.loads(f.read()))
+    return trajectory
 
-def parse_trajectory_step(step_str: str) -> tuple | None:
+def parse_legacy_step(step_str: str) -> dict | None:
     tool_match = re.search(r"tool='([^']*)'", step_str)
-    tool_input_match = re.search(r"tool_input=({.*?})", step_str, re.DOTALL)
-    observation_split = re.split(r",\s+'", step_str, 1)
-    if not tool_match or not tool_input_match or len(observation_split) < 2:
+    # Anchored on the next field, since tool inputs such as PromQL queries contain braces.
+    # ReAct actions usually carry a string input, structured ones a dict.
+    tool_input_match = re.search(r"tool_input=(.*?), log=", step_str, re.DOTALL)
+    observation_match = re.search(r"\),\s+((['\"]).*\2)\)\s*$", step_str, re.DOTALL)
+    if not tool_match or not tool_input_match or not observation_match:
         return None
+    # Both are Python reprs, so literal_eval undoes their quoting and escapes.
     try:
-        tool_input = json.loads(observation_split[0].split("tool_input=")[1].replace("'", "\""))
-    except:
-        tool_input = observation_split[0].split("tool_input=")[1]
-    return (SimpleToolAction(tool=tool_match.group(1), tool_input=tool_input), observation_split[1].strip(" '()"))
+        tool_input = ast.literal_eval(tool_input_match.group(1))
+    except (ValueError, SyntaxError):
+        tool_input = tool_input_match.group(1)
+    try:
+        observation = ast.literal_eval(observation_match.group(1))
+    except (ValueError, SyntaxError):
+        observation = observation_match.group(1)[1:-1]
+    return {"tool": tool_match.group(1), "tool_input": tool_input, "observation": observation}
 
 def format_prompt(alert: dict, trajectory: list) -> str:
     try:
-        trajectory_str = "\n\n".join([f"Step {i+1}:\n- Tool: {step[0].tool}\n- Input: {step[0].tool_input}\n- Observation: {step[1]}" for i, step in enumerate(trajectory)])
+        trajectory_str = "\n\n".join([f"Step {i+1}:\n- Tool: {step['tool']}\n- Input: {step['tool_input']}\n- Observation: {step['observation']}" for i, step in enumerate(trajectory)])
     except Exception:
         trajectory_str = "Could not parse trajectory."
     return f"""<s><|user|>
 You are an expert SRE agent. You were given the following alert:
 **Alert:**
 ```json
-{json.dumps(alert, indent=2)}```
+{orjson.dumps(alert, option=orjson.OPT_INDENT_2).decode()}```
 You performed an investigation and took the following steps (your trajectory):
 **Trajectory:**
 {trajectory_str}
 Based on all of this information, what is the final root cause analysis?<|end|>
 <|assistant|>"""
 
+def process_one_run(run) -> dict | None:
+    """Downloads a validated run's artifacts and turns them into a single training sample."""
+    run_id, feedback_status = run.info.run_id, run.data.tags.get("feedback_status")
+    try:
+        # Each run is downloaded into its own directory so trajectory files never mix.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            local_path = mlflow.artifacts.download_artifacts(run_id=run_id, dst_path=tmpdir)
+            with open(os.path.join(local_path, "final_report.json"), "r") as report_file:
+                report = orjson.loads(report_file.read())
+            with open(os.path.join(local_path, "alert_payload.json"), "r") as alert_file:
+                alert = orjson.loads(alert_file.read())
+            
+            trajectory = load_trajectory(local_path, report)
+            if not trajectory:
+                logger.warning(f"Skipping run {run_id}: no trajectory steps were recorded.")
+                return None
+            instruction = format_prompt(alert.get('raw_alert', alert), trajectory)
+            
+            response = ""
+            if feedback_status == "Approved":
+                response = report.get("final_conclusion", "")
+            elif feedback_status == "Corrected":
+                with open(os.path.join(local_path, "human_feedback.txt"), "r") as fb_file:
+                    response = fb_file.read()
+
+        if instruction and response:
+            return {"text": f"{instruction}{response}</s>"}
+    except Exception:
+        logger.error(f"Skipping run {run_id} due to processing error.", exc_info=True)
+    return None
+
 def main():
     logger.info(f"Connecting to MLflow at {MLFLOW_TRACKING_URI}...")
     try:
@@ -61,8 +117,17 @@ def main():
         logger.error(f"Could not connect to MLflow. Is the stack running? Run 'docker compose up -d'. Error: {e}")
         return
 
-    all_runs = client.search_runs(experiment_ids=[exp.experiment_id])
-    filtered_runs = [run for run in all_runs if run.data.tags.get("feedback_status") in ["Approved", "Corrected"]]
+    # Filter on the MLflow server so only validated runs cross the wire. Tag filters
+    # do not support IN, so each feedback status is its own query.
+    filtered_runs = []
+    for status in VALIDATED_FEEDBACK_STATUSES:
+        filtered_runs.extend(client.search_runs(
+            experiment_ids=[exp.experiment_id],
+            filter_string=f"tags.feedback_status = '{status}'",
+            order_by=["start_time DESC"],
+            max_results=10000
+        ))
+    filtered_runs.sort(key=lambda run: run.info.start_time, reverse=True)
     
     if not filtered_runs:
         logger.warning("No runs with 'Approved' or 'Corrected' feedback found. No data to export.")
@@ -71,34 +136,12 @@ def main():
     logger.info(f"Found {len(filtered_runs)} validated runs to export.")
     
     exported_samples = 0
-    with open(OUTPUT_FILE, 'w') as f:
-        for run in filtered_runs:
-            run_id, feedback_status = run.info.run_id, run.data.tags.get("feedback_status")
-            try:
-                local_path = client.download_artifacts(run_id, ".", "/tmp/")
-                with open(os.path.join(local_path, "final_report.json"), "r") as report_file:
-                    report = json.load(report_file)
-                with open(os.path.join(local_path, "alert_payload.json"), "r") as alert_file:
-                    alert = json.load(alert_file)
-                
-                full_trajectory_str_list = report.get("full_trajectory", [])
-                trajectory = [parse_trajectory_step(s) for s in full_trajectory_str_list if s]
-                trajectory = [s for s in trajectory if s is not None]
-                instruction = format_prompt(alert.get('raw_alert', alert), trajectory)
-                
-                response = ""
-                if feedback_status == "Approved":
-                    response = report.get("final_conclusion", "")
-                elif feedback_status == "Corrected":
-                    with open(os.path.join(local_path, "human_feedback.txt"), "r") as fb_file:
-                        response = fb_file.read()
-
-                if instruction and response:
-                    training_sample = {"text": f"{instruction}{response}</s>"}
-                    f.write(json.dumps(training_sample) + "\n")
-                    exported_samples += 1
-            except Exception:
-                logger.error(f"Skipping run {run_id} due to processing error.", exc_info=True)
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor, open(OUTPUT_FILE, 'w') as f:
+        # Samples are written from this thread, in the same order as the runs.
+        for training_sample in executor.map(process_one_run, filtered_runs):
+            if training_sample:
+                f.write(orjson.dumps(training_sample).decode() + "\n")
+                exported_samples += 1
     
     logger.info(f"Successfully exported {exported_samples} samples to '{OUTPUT_FILE}'. This file is ready to be uploaded to Colab.")
 
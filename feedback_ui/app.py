@@ -4,8 +4,12 @@ import os
 import streamlit as st
 import mlflow
 import pandas as pd
+import numpy as np
 import json
 import time
+import shutil
+import tempfile
+import threading
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -21,6 +25,19 @@ client = mlflow.tracking.MlflowClient()
 
 MLFLOW_EXPERIMENT_NAME = "AIDA_Investigations"
 
+# Completed investigations never change, so their artifacts are downloaded once and
+# kept on local disk. The most recent runs are prefetched while the table is shown.
+ARTIFACT_CACHE_DIR = "/tmp/aida_cache"
+PREFETCH_RUN_COUNT = 20
+
+# The runs table lives in session state and is refreshed incrementally: new runs and
+# runs still in progress are fetched every few seconds, with a periodic full resync
+# to pick up feedback submitted from other sessions.
+RUNS_REFRESH_INTERVAL_SECONDS = 10
+RUNS_FULL_RESYNC_INTERVAL_SECONDS = 300
+MAX_TRACKED_UNFINISHED_RUNS = 100
+RUNS_COLUMNS = ["Run ID", "Incident ID", "Alert Name", "Status", "Feedback", "Created At"]
+
 # --- Helper Functions ---
 
 @st.cache_data(ttl=60)
@@ -34,46 +51,160 @@ def get_experiment_id(experiment_name):
     except Exception:
         return None
 
-@st.cache_data(ttl=10)
-def get_all_runs(_exp_id):
-    """Fetches all runs from an experiment and returns them as a DataFrame."""
-    if not _exp_id:
-        return pd.DataFrame()
-        
-    runs = client.search_runs(experiment_ids=[_exp_id], order_by=["start_time DESC"])
-    
-    processed_runs = []
+def runs_to_dataframe(runs):
+    """
+    Converts MLflow runs into rows of the runs table. Columns are filled in one pass and
+    handed to pandas as arrays, so no per-row dicts are built and the timestamps are
+    converted in a single vectorized call.
+    """
+    run_ids, incident_ids, alert_names, statuses, feedback, start_times = [], [], [], [], [], []
     for run in runs:
-        processed_runs.append({
-            "Run ID": run.info.run_id,
-            "Incident ID": run.data.tags.get("incident_id", "N/A"),
-            "Alert Name": run.data.tags.get("alert_name", "N/A"),
-            "Status": run.data.tags.get("investigation_status", "N/A"),
-            "Feedback": run.data.tags.get("feedback_status", "Pending"),
-            "Created At": pd.to_datetime(run.info.start_time, unit="ms")
-        })
-    return pd.DataFrame(processed_runs)
-
-@st.cache_data(ttl=30)
-def load_run_artifacts(run_id):
+        tags = run.data.tags
+        run_ids.append(run.info.run_id)
+        incident_ids.append(tags.get("incident_id", "N/A"))
+        alert_names.append(tags.get("alert_name", "N/A"))
+        statuses.append(tags.get("investigation_status", "N/A"))
+        feedback.append(tags.get("feedback_status", "Pending"))
+        start_times.append(run.info.start_time)
+
+    return pd.DataFrame({
+        "Run ID": run_ids,
+        "Incident ID": incident_ids,
+        "Alert Name": alert_names,
+        "Status": statuses,
+        "Feedback": feedback,
+        "Created At": pd.to_datetime(np.asarray(start_times, dtype="int64"), unit="ms")
+    }, columns=RUNS_COLUMNS)
+
+def get_all_runs(exp_id):
+    """
+    Returns all runs of an experiment as a DataFrame, newest first. The first call loads
+    every run; later calls only fetch runs started since the last fetch plus runs that
+    were still in progress, and merge them into the cached table.
+    """
+    if not exp_id:
+        return pd.DataFrame()
+
+    state = st.session_state
+    now = time.time()
+    if "runs_df" not in state or now - state.runs_synced_at > RUNS_FULL_RESYNC_INTERVAL_SECONDS:
+        runs = client.search_runs(experiment_ids=[exp_id], order_by=["start_time DESC"])
+        state.runs_df = runs_to_dataframe(runs)
+        state.runs_last_seen_ms = max((run.info.start_time for run in runs), default=0)
+        state.runs_synced_at = state.runs_fetched_at = now
+        return state.runs_df
+
+    if now - state.runs_fetched_at < RUNS_REFRESH_INTERVAL_SECONDS:
+        return state.runs_df
+
+    cached_df = state.runs_df
+    changed_runs = list(client.search_runs(
+        experiment_ids=[exp_id],
+        filter_string=f"attributes.start_time > {state.runs_last_seen_ms}"
+    ))
+    unfinished_ids = cached_df.loc[cached_df["Status"] == "N/A", "Run ID"].head(MAX_TRACKED_UNFINISHED_RUNS).tolist()
+    if unfinished_ids:
+        quoted_ids = ", ".join(f"'{run_id}'" for run_id in unfinished_ids)
+        changed_runs.extend(client.search_runs(
+            experiment_ids=[exp_id],
+            filter_string=f"attributes.run_id IN ({quoted_ids})"
+        ))
+    state.runs_fetched_at = now
+
+    if changed_runs:
+        state.runs_last_seen_ms = max(state.runs_last_seen_ms, *(run.info.start_time for run in changed_runs))
+        state.runs_df = (
+            pd.concat([cached_df, runs_to_dataframe(changed_runs)])
+            .drop_duplicates(subset="Run ID", keep="last")
+            .sort_values("Created At", ascending=False, ignore_index=True)
+        )
+    return state.runs_df
+
+def load_trajectory(local_path, report):
     """
-    Safely downloads and loads the required JSON artifacts for a given run.
-    The @st.cache_data decorator ensures this function completes fully before the
-    rest of the script continues, preventing race conditions.
+    Reads the agent steps that were streamed to `trajectory/step_{i}.json`, in order.
+    Older runs embedded the trajectory in the final report instead.
     """
+    trajectory_dir = os.path.join(local_path, "trajectory")
+    if not os.path.isdir(trajectory_dir):
+        return report.get("full_trajectory", [])
+
+    step_files = sorted(os.listdir(trajectory_dir), key=lambda name: int(name[len("step_"):-len(".json")]))
+    trajectory = []
+    for step_file in step_files:
+        with open(os.path.join(trajectory_dir, step_file), "r") as f:
+            trajectory.append(json.load(f))
+    return trajectory
+
+def fetch_run_artifacts(run_id):
+    """
+    Returns the local directory holding a run's artifacts, downloading them on first use.
+    A run is only kept in the disk cache once its final report exists; investigations
+    still in progress raise and are downloaded again on the next attempt.
+    """
+    cached_path = os.path.join(ARTIFACT_CACHE_DIR, run_id)
+    if os.path.exists(os.path.join(cached_path, "final_report.json")):
+        return cached_path
+
+    os.makedirs(ARTIFACT_CACHE_DIR, exist_ok=True)
+    staging_path = tempfile.mkdtemp(dir=ARTIFACT_CACHE_DIR)
     try:
-        local_path = client.download_artifacts(run_id, ".", "/tmp/")
-        
-        with open(os.path.join(local_path, "final_report.json"), "r") as f:
-            report = json.load(f)
-        with open(os.path.join(local_path, "alert_payload.json"), "r") as f:
-            alert = json.load(f)
-            
-        return alert, report
+        client.download_artifacts(run_id, ".", staging_path)
+        if not os.path.exists(os.path.join(staging_path, "final_report.json")):
+            raise FileNotFoundError(f"Run {run_id} has no final report yet.")
+        try:
+            os.replace(staging_path, cached_path)
+        except OSError:
+            pass # A concurrent download already populated the cache
+        return cached_path
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+@st.cache_resource(max_entries=256)
+def _load_cached_artifacts(run_id):
+    """
+    Parses a run's artifacts once per process. cache_resource hands back the same
+    objects on every rerun instead of copying them the way cache_data does.
+    """
+    local_path = fetch_run_artifacts(run_id)
+    with open(os.path.join(local_path, "final_report.json"), "r") as f:
+        report = json.load(f)
+    with open(os.path.join(local_path, "alert_payload.json"), "r") as f:
+        alert = json.load(f)
+    return alert, report, load_trajectory(local_path, report)
+
+def load_run_artifacts(run_id):
+    """Loads the alert, final report, and trajectory for a run, reporting any failure in the UI."""
+    try:
+        return _load_cached_artifacts(run_id)
     except Exception as e:
         st.error(f"Failed to load artifacts for run {run_id}.")
         st.exception(e)
-        return None, None
+        return None, None, None
+
+@st.cache_resource
+def _prefetch_lock():
+    """A process-wide lock that keeps at most one prefetch thread running."""
+    return threading.Lock()
+
+def prefetch_run_artifacts(run_ids):
+    """Downloads artifacts for the given runs into the disk cache on a background thread."""
+    pending = [r for r in run_ids if not os.path.exists(os.path.join(ARTIFACT_CACHE_DIR, r, "final_report.json"))]
+    lock = _prefetch_lock()
+    if not pending or not lock.acquire(blocking=False):
+        return
+
+    def prefetch():
+        try:
+            for run_id in pending:
+                try:
+                    fetch_run_artifacts(run_id)
+                except Exception:
+                    pass # Fetched (and reported) on demand if the user selects this run
+        finally:
+            lock.release()
+
+    threading.Thread(target=prefetch, daemon=True).start()
 
 
 def submit_feedback(run_id, feedback_status, feedback_text=None):
@@ -83,8 +214,10 @@ def submit_feedback(run_id, feedback_status, feedback_text=None):
         if feedback_text:
             client.log_text(run_id, feedback_text, "human_feedback.txt")
         
-        # Clear the caches to force a reload of the table data on the next action
-        st.cache_data.clear()
+        # Update the cached table in place rather than refetching every run
+        if "runs_df" in st.session_state:
+            runs_df = st.session_state.runs_df
+            runs_df.loc[runs_df["Run ID"] == run_id, "Feedback"] = feedback_status
         
         st.success(f"Feedback successfully updated to '{feedback_status}'!")
         time.sleep(2) # Give user a moment to see the success message
@@ -106,6 +239,9 @@ else:
     if runs_df.empty:
         st.info("No investigations found yet. Please trigger an alert to start an investigation.")
     else:
+        finished_runs = runs_df[runs_df["Status"] == "complete_success"]["Run ID"]
+        prefetch_run_artifacts(finished_runs.head(PREFETCH_RUN_COUNT).tolist())
+
         st.header("Completed Investigations")
         st.info("Click on a row in the table below to select an investigation and provide feedback.")
 
@@ -124,7 +260,7 @@ else:
             st.divider()
             st.header(f"Investigation Details for Run: {selected_run_id}")
             
-            alert, report = load_run_artifacts(selected_run_id)
+            alert, report, trajectory = load_run_artifacts(selected_run_id)
 
             if alert and report:
                 col1, col2 = st.columns(2)
@@ -136,7 +272,7 @@ else:
                     st.info(report.get("final_conclusion", "No conclusion found."))
 
                 with st.expander("Show Full Agent Trajectory (Chain of Thought)"):
-                    st.json(report.get("full_trajectory", "No trajectory found."))
+                    st.json(trajectory or "No trajectory found.")
 
                 # --- Final, Robust Feedback Form ---
                 st.divider()
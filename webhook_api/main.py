@@ -1,39 +1,317 @@
 # AIDA/webhook_api/main.py
 import os
+import asyncio
 import redis
-import json
+from redis import asyncio as aioredis
+import orjson
+import msgpack
 import logging
+import logging.handlers
+import atexit
+import queue
 import uuid
-from fastapi import FastAPI, Request, HTTPException
+import zlib
+from fastapi import FastAPI, Request, Response, HTTPException
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+
+# uvloop's libuv-based event loop cuts per-syscall overhead on the HTTP and Redis
+# sockets. The Dockerfile already selects it for uvicorn; installing the policy here
+# covers other ways of launching the app. Fall back to asyncio if it is missing.
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 # --- Basic Setup ---
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Log records are handed to a queue and written to stderr by a listener thread, so
+# the request path never blocks on the handler lock or on terminal I/O.
+log_queue = queue.SimpleQueue()
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+queue_handler = logging.handlers.QueueHandler(log_queue)
+root_logger = logging.getLogger()
+root_logger.setLevel(logging.INFO)
+root_logger.addHandler(queue_handler)
+# uvicorn configures its loggers before importing the app, giving them their own stream
+# handlers that do not propagate to the root (including the per-request access log),
+# so they are pointed at the queue as well.
+for uvicorn_logger_name in ("uvicorn", "uvicorn.access"):
+    logging.getLogger(uvicorn_logger_name).handlers = [queue_handler]
+log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+log_listener.start()
+# Stopping the listener flushes whatever is still queued, including shutdown logs.
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # --- Initialize FastAPI App ---
 app = FastAPI(
     title="AIDA Webhook Ingestion API",
     description="Receives alerts and dispatches them to the AIDA agent via a Redis queue.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
+# Even a large grouped Alertmanager notification is well under this. The cap bounds
+# per-request memory, so one oversized body cannot stall every other request in GC.
+MAX_WEBHOOK_BODY_BYTES = 1024 * 1024
+BODY_TOO_LARGE_DETAIL = f"Payload Too Large: Webhook bodies are limited to {MAX_WEBHOOK_BODY_BYTES} bytes."
+
+
+class GzipRequestMiddleware:
+    """
+    ASGI middleware that transparently inflates request bodies sent with
+    `Content-Encoding: gzip`, so large grouped-alert payloads can be compressed on
+    the wire while the handlers keep reading plain JSON.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    async def _reject(scope, receive, send, status_code: int, detail: str):
+        response = ORJSONResponse({"detail": detail}, status_code=status_code)
+        await response(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (b"content-encoding", b"gzip") not in scope["headers"]:
+            await self.app(scope, receive, send)
+            return
+
+        # Reject up front when the sender already declares a body over the limit.
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > MAX_WEBHOOK_BODY_BYTES:
+            await self._reject(scope, receive, send, 413, BODY_TOO_LARGE_DETAIL)
+            return
+
+        # wbits=16+MAX_WBITS accepts the gzip header; chunks are inflated as they arrive.
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = []
+        received_size = 0
+        inflated_size = 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                data = message.get("body", b"")
+                # The limit applies to both the compressed and the inflated body. Never
+                # inflate more than one byte past it, so a small compressed body cannot
+                # expand without bound.
+                received_size += len(data)
+                chunk = decompressor.decompress(data, MAX_WEBHOOK_BODY_BYTES - inflated_size + 1)
+                inflated_size += len(chunk)
+                if received_size > MAX_WEBHOOK_BODY_BYTES or inflated_size > MAX_WEBHOOK_BODY_BYTES:
+                    logger.warning("Rejected request: gzip body exceeds the size limit.")
+                    await self._reject(scope, receive, send, 413, BODY_TOO_LARGE_DETAIL)
+                    return
+                # zlib parks any bytes after the end of the gzip stream in unused_data,
+                # where nothing would bound them, so trailing data is an invalid body.
+                if decompressor.unused_data:
+                    raise zlib.error("data after end of gzip stream")
+                chunks.append(chunk)
+                more_body = message.get("more_body", False)
+            chunks.append(decompressor.flush())
+            if not decompressor.eof:
+                raise zlib.error("truncated gzip stream")
+        except zlib.error:
+            logger.warning("Failed to process request: Invalid gzip body.")
+            await self._reject(scope, receive, send, 400, "Bad Request: Invalid gzip body.")
+            return
+
+        body = b"".join(chunks)
+        # The body handed on is plain, so drop the headers that describe the compressed one.
+        scope = dict(scope)
+        scope["headers"] = [
+            (name, value) for name, value in scope["headers"]
+            if name not in (b"content-encoding", b"content-length")
+        ]
+        body_sent = False
+
+        async def receive_inflated():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, receive_inflated, send)
+
+
+app.add_middleware(GzipRequestMiddleware)
+# Compresses larger responses (e.g. the OpenAPI schema) for clients that accept gzip.
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
 # --- Connect to Redis ---
 # The hostname 'redis' is resolvable because all our services are in the same
 # Docker Compose network, as defined in our docker-compose.yml file.
 redis_host = os.getenv("REDIS_HOST", "localhost")
 redis_client = None
-try:
-    # decode_responses=True ensures that Redis returns strings, not bytes.
-    redis_client = redis.Redis(host=redis_host, port=6379, db=0, decode_responses=True)
-    # Check if the connection is alive.
-    redis_client.ping()
-    logger.info(f"Successfully connected to Redis at '{redis_host}'")
-except redis.exceptions.ConnectionError as e:
-    logger.error(f"FATAL: Could not connect to Redis: {e}. The API cannot queue jobs.")
-    # In a real scenario, you might want the container to exit or have more complex retry logic.
+# Connections per worker process. Requests only touch Redis through the batching task
+# and /healthz, so a handful is plenty; raise it if more Redis calls move onto requests.
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "16"))
+
+# Webhooks are buffered in-process and pushed to Redis in batches by a background task.
+# Small batches keep the added latency to well under a millisecond under bursts.
+ENQUEUE_BATCH_SIZE = 64
+JOB_QUEUE_MAX_SIZE = 10000
+SHUTDOWN_FLUSH_TIMEOUT_SECONDS = 5
+MAX_INFLIGHT_PUSHES = 4
+job_queue = None
+flush_task = None
+push_slots = None
+pending_pushes = set()
+# Whether Redis is currently accepting jobs. The startup ping, every push and a
+# background probe keep it current, so webhooks are refused with a 503 (and retried
+# by Alertmanager) instead of being accepted and then dropped while Redis is down.
+redis_ready = False
+REDIS_PROBE_INTERVAL_SECONDS = 2
+probe_task = None
+
+@app.on_event("startup")
+async def connect_to_redis():
+    """
+    Creates the asyncio Redis client on the event loop that will use it, so Redis
+    round-trips no longer block the loop while other webhooks wait.
+    """
+    global redis_client, job_queue, flush_task, push_slots, redis_ready, probe_task
+    # Jobs are pushed as bytes, so responses are left undecoded as well.
+    # Idle connections are health-checked by the client itself, so the request path
+    # never has to ping Redis before using it.
+    # Explicit timeouts turn a hung Redis into a fast error instead of a stalled task.
+    pool = aioredis.ConnectionPool(
+        host=redis_host,
+        port=6379,
+        db=0,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_timeout=2,
+        socket_connect_timeout=1,
+        socket_keepalive=True,
+        retry_on_timeout=True,
+        health_check_interval=30
+    )
+    redis_client = aioredis.Redis(connection_pool=pool)
+    try:
+        # Check if the connection is alive.
+        await redis_client.ping()
+        redis_ready = True
+        logger.info(f"Successfully connected to Redis at '{redis_host}'")
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not connect to Redis: {e}. Webhooks are refused until it is reachable.")
+
+    job_queue = asyncio.Queue(maxsize=JOB_QUEUE_MAX_SIZE)
+    push_slots = asyncio.Semaphore(MAX_INFLIGHT_PUSHES)
+    flush_task = asyncio.create_task(flush_jobs())
+    probe_task = asyncio.create_task(probe_redis())
+
+@app.on_event("shutdown")
+async def close_redis():
+    # Push whatever is still buffered, and wait for in-flight pushes to be
+    # acknowledged, before the connection goes away.
+    if job_queue is not None:
+        try:
+            await asyncio.wait_for(job_queue.join(), timeout=SHUTDOWN_FLUSH_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logger.error(f"Shutting down with {job_queue.qsize()} jobs still buffered.")
+    if flush_task:
+        flush_task.cancel()
+    if probe_task:
+        probe_task.cancel()
+    for task in list(pending_pushes):
+        task.cancel()
+    if redis_client:
+        await redis_client.aclose()
+
+async def probe_redis():
+    """Background task that pings Redis while it is marked unavailable, to notice recovery."""
+    global redis_ready
+    while True:
+        await asyncio.sleep(REDIS_PROBE_INTERVAL_SECONDS)
+        if redis_ready:
+            continue
+        try:
+            await redis_client.ping()
+            redis_ready = True
+            logger.info(f"Redis at '{redis_host}' is reachable again. Accepting webhooks.")
+        except redis.exceptions.RedisError:
+            pass
+
+async def push_batch(batch: list):
+    """Pushes one batch of buffered jobs to Redis with a single variadic LPUSH."""
+    global redis_ready
+    try:
+        # lpush adds the new jobs to the left (head) of the list one after another, so
+        # the worker popping from the right sees a batch in arrival order. Up to
+        # MAX_INFLIGHT_PUSHES batches are pushed concurrently on separate connections,
+        # though, so one batch can land before an earlier one: order is best-effort.
+        await redis_client.lpush(AIDA_JOB_QUEUE, *[blob for _, blob in batch])
+        # Per-batch and per-request logs pass their arguments to the logger, which only
+        # formats the message if the record is actually emitted.
+        logger.info("Dispatched %d jobs to queue '%s'.", len(batch), AIDA_JOB_QUEUE_NAME)
+        redis_ready = True
+    except redis.exceptions.RedisError:
+        redis_ready = False
+        incident_ids = ", ".join(incident_id for incident_id, _ in batch)
+        logger.error("Failed to dispatch jobs for incidents: %s", incident_ids, exc_info=True)
+    finally:
+        for _ in batch:
+            job_queue.task_done()
+
+def _on_push_done(task: asyncio.Task):
+    pending_pushes.discard(task)
+    push_slots.release()
+    if not task.cancelled() and task.exception():
+        logger.error("Unexpected error while dispatching jobs.", exc_info=task.exception())
+
+async def flush_jobs():
+    """
+    Background task that drains the in-process job buffer. Jobs that arrive in the
+    same burst are pushed with one command and round-trip instead of one each, and
+    batches are sent without waiting for the previous one to be acknowledged.
+    """
+    while True:
+        # Bounding in-flight pushes keeps them within the connection pool; while all
+        # slots are busy, new jobs simply accumulate into the next batch.
+        await push_slots.acquire()
+        batch = [await job_queue.get()]
+        while len(batch) < ENQUEUE_BATCH_SIZE and not job_queue.empty():
+            batch.append(job_queue.get_nowait())
+        # Keep a reference so the task is not garbage-collected mid-flight.
+        task = asyncio.create_task(push_batch(batch))
+        pending_pushes.add(task)
+        task.add_done_callback(_on_push_done)
 
 # This is the name of the list in Redis that will act as our job queue.
-AIDA_JOB_QUEUE = "aida_job_queue"
+AIDA_JOB_QUEUE_NAME = "aida_job_queue"
+# The key is kept pre-encoded so redis-py sends it as-is instead of encoding it per push.
+AIDA_JOB_QUEUE = AIDA_JOB_QUEUE_NAME.encode()
+
+async def read_limited_body(request: Request) -> bytes:
+    """
+    Reads the request body, rejecting it with a 413 as soon as it is known to exceed
+    MAX_WEBHOOK_BODY_BYTES: up front from Content-Length when the sender declares it,
+    otherwise (e.g. chunked uploads) once the running total passes the limit.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_WEBHOOK_BODY_BYTES:
+        raise HTTPException(status_code=413, detail=BODY_TOO_LARGE_DETAIL)
+
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_WEBHOOK_BODY_BYTES:
+            raise HTTPException(status_code=413, detail=BODY_TOO_LARGE_DETAIL)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+# The 202 body only varies in the incident ID (plain hex, so it needs no escaping),
+# so it is spliced together from pre-encoded halves instead of going through the
+# response encoder on every request.
+ACCEPTED_BODY_PREFIX = b'{"status":"accepted","incident_id":"'
+ACCEPTED_BODY_SUFFIX = b'","message":"AIDA has been dispatched to investigate."}'
 
 # --- API Endpoints ---
 
@@ -42,42 +320,63 @@ def read_root():
     """A simple endpoint to confirm the API is running."""
     return {"message": "AIDA Webhook API is running and ready to receive alerts."}
 
+@app.get("/healthz", tags=["Health Check"])
+async def healthz():
+    """Liveness probe that checks the Redis connection, kept off the webhook hot path."""
+    global redis_ready
+    try:
+        if redis_client and await redis_client.ping():
+            redis_ready = True
+            return {"status": "ok"}
+    except redis.exceptions.RedisError:
+        redis_ready = False
+    raise HTTPException(status_code=503, detail="Service Unavailable: Cannot connect to Redis queue.")
+
 @app.post("/webhook", status_code=202, tags=["Incident Handling"])
 async def receive_webhook(request: Request):
     """
     Receives alerts (e.g., from Prometheus Alertmanager), assigns an incident ID,
-    and pushes a job to the Redis queue for the AIDA agent to process.
+    and pushes a job to the Redis queue for the AIDA agent to process. While Redis is
+    known to be unavailable, alerts are refused with a 503 so the sender retries; jobs
+    already buffered when a push fails are logged and dropped.
     """
-    if not redis_client or not redis_client.ping():
+    if not redis_ready:
         logger.error("Cannot process webhook: Redis service is unavailable.")
         raise HTTPException(status_code=503, detail="Service Unavailable: Cannot connect to Redis queue.")
 
+    body = await read_limited_body(request)
     try:
-        alert_data = await request.json()
-        logger.info("Webhook received.")
-
-        # Create a job package for the AIDA agent.
-        # We assign our own unique ID to track this incident internally.
-        incident_id = str(uuid.uuid4())
-        job_payload = {
-            "incident_id": incident_id,
-            "raw_alert": alert_data
-        }
-
-        # Push the job to the Redis list (which we use as a queue).
-        # lpush adds the new job to the left (head) of the list.
-        redis_client.lpush(AIDA_JOB_QUEUE, json.dumps(job_payload))
-        logger.info(f"Dispatched job for incident_id '{incident_id}' to queue '{AIDA_JOB_QUEUE}'.")
-
-        return {
-            "status": "accepted",
-            "incident_id": incident_id,
-            "message": "AIDA has been dispatched to investigate."
-        }
-
-    except json.JSONDecodeError:
+        # Parse only to reject malformed JSON; the alert is forwarded as the original
+        # bytes, so it is never rebuilt into Python objects and re-encoded here.
+        orjson.loads(body)
+    except orjson.JSONDecodeError:
         logger.warning("Failed to process webhook: Invalid JSON payload.")
         raise HTTPException(status_code=400, detail="Bad Request: Invalid JSON payload.")
-    except Exception as e:
-        logger.error(f"An unexpected error occurred while processing webhook: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Internal Server Error.")
\ No newline at end of file
+    logger.info("Webhook received.")
+
+    # Create a job package for the AIDA agent.
+    # We assign our own unique ID to track this incident internally.
+    incident_id = uuid.uuid4().hex
+    job_payload = {
+        "incident_id": incident_id,
+        "raw_alert": body
+    }
+    # Alertmanager receivers can route a team's alerts to its own LoRA adapter
+    # by calling /webhook?adapter=<name>.
+    adapter_name = request.query_params.get("adapter")
+    if adapter_name:
+        job_payload["adapter_name"] = adapter_name
+
+    # Hand the job to the batching task, which pushes it to the Redis list
+    # (which we use as a queue). This only waits if the buffer is full, and never
+    # talks to Redis itself: push failures are logged by the batching task.
+    # Jobs are packed with MessagePack: the queue is internal to AIDA, and the
+    # binary encoding is smaller and faster to (un)pack than JSON.
+    await job_queue.put((incident_id, msgpack.packb(job_payload, use_bin_type=True)))
+    logger.info("Queued job for incident_id '%s' for dispatch to '%s'.", incident_id, AIDA_JOB_QUEUE_NAME)
+
+    return Response(
+        content=ACCEPTED_BODY_PREFIX + incident_id.encode() + ACCEPTED_BODY_SUFFIX,
+        media_type="application/json",
+        status_code=202
+    )